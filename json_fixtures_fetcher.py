@@ -1,9 +1,9 @@
 import json
+import os
 from collections import defaultdict
 
 from cds_common.utils import get_env
-from sqlalchemy import create_engine, inspect, text
-from sqlalchemy.dialects.postgresql import JSONB, JSON
+from sqlalchemy import Text, cast, column, create_engine, select, table, text
 from sqlalchemy.orm import sessionmaker
 
 """
@@ -24,47 +24,91 @@ def main():
     Session = sessionmaker(bind=engine)
     session = Session()
 
-    inspector = inspect(engine)
     schema_name = "public"
-    table_names = inspector.get_table_names(schema=schema_name)
 
-    json_fixtures = defaultdict(dict)
-    for table_name in table_names:
-        columns = inspector.get_columns(table_name, schema=schema_name)
-        for column in columns:
-            column_type = column["type"]
-            if not isinstance(column_type, (JSON, JSONB)):
-                continue
-
-            query = text(
-                f"SELECT {column['name']} FROM {schema_name}.{table_name} "
-                f"WHERE {column['name']} IS NOT NULL "
-                f"AND {column['name']}::text != 'null'::text "
-                f"AND {column['name']}::text != '{{}}'::text "
-                f"AND {column['name']}::text != '[]'::text LIMIT 1"
-            )
-            result = session.execute(query).scalar()
-
-            if result:
-                json_fixtures[table_name][column["name"]] = result
-                continue
-
-            query = text(
-                f"SELECT {column['name']} FROM {schema_name}.{table_name} "
-                f"WHERE {column['name']} IS NOT NULL "
-                f"AND {column['name']}::text != 'null'::text"
-            )
-            result = session.execute(query).scalar()
-
-            if not result:
-                continue
-
-            json_fixtures[table_name][column["name"]] = result
-
-    session.close()
-
-    with open("./json_fixtures.json", "w") as f:
-        json.dump(json_fixtures, f)
+    json_columns_by_table = defaultdict(list)
+    for table_name, column_name in session.execute(
+        text(
+            """
+            SELECT c.table_name, c.column_name
+            FROM information_schema.columns c
+            JOIN information_schema.tables t
+                ON t.table_schema = c.table_schema AND t.table_name = c.table_name
+            WHERE c.table_schema = :schema_name
+                AND t.table_type = 'BASE TABLE'
+                AND c.data_type IN ('json', 'jsonb')
+            ORDER BY c.table_name, c.ordinal_position
+        """
+        ),
+        {"schema_name": schema_name},
+    ):
+        json_columns_by_table[table_name].append(column_name)
+
+    fixtures_path = "./json_fixtures.json"
+    tmp_fixtures_path = f"{fixtures_path}.tmp"
+    try:
+        with open(tmp_fixtures_path, "w") as f:
+            f.write("{")
+            separator = ""
+            for table_name, json_columns in json_columns_by_table.items():
+                # One round trip per table: for every JSON column select both a "rich"
+                # sample (not empty object/array) and any non-null sample as a fallback.
+                table_obj = table(
+                    table_name,
+                    *(column(name) for name in json_columns),
+                    schema=schema_name,
+                )
+                samples = []
+                for index, column_name in enumerate(json_columns):
+                    column_obj = table_obj.c[column_name]
+                    column_text = cast(column_obj, Text)
+                    samples.append(
+                        select(column_obj)
+                        .where(
+                            column_obj.isnot(None),
+                            column_text != "null",
+                            column_text != "{}",
+                            column_text != "[]",
+                        )
+                        .limit(1)
+                        .scalar_subquery()
+                        .label(f"rich_{index}")
+                    )
+                    samples.append(
+                        select(column_obj)
+                        .where(column_obj.isnot(None), column_text != "null")
+                        .limit(1)
+                        .scalar_subquery()
+                        .label(f"any_{index}")
+                    )
+                row = session.execute(select(*samples)).mappings().one()
+
+                table_fixtures = {}
+                for index, column_name in enumerate(json_columns):
+                    result = row[f"rich_{index}"] or row[f"any_{index}"]
+                    if not result:
+                        continue
+
+                    table_fixtures[column_name] = result
+
+                # Flush each table as soon as it is sampled instead of keeping
+                # every JSON blob of the database in memory until the end.
+                if not table_fixtures:
+                    continue
+                f.write(
+                    f"{separator}{json.dumps(table_name)}: {json.dumps(table_fixtures)}"
+                )
+                separator = ", "
+            f.write("}")
+    except BaseException:
+        # Don't leave a partial fixtures file behind when a probe fails.
+        if os.path.exists(tmp_fixtures_path):
+            os.remove(tmp_fixtures_path)
+        raise
+    finally:
+        session.close()
+
+    os.replace(tmp_fixtures_path, fixtures_path)
 
 
 if __name__ == "__main__":
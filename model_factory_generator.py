@@ -1,6 +1,9 @@
 import inspect
+import json
+import logging
 import types
-from typing import Set, Dict, Any
+import weakref
+from typing import Set, Dict, Any, Tuple
 
 import factory
 from cds_common.cds_rds_v1.tables import Base as BaseModel
@@ -19,6 +22,23 @@ from sqlalchemy.dialects import postgresql
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.orm import DeclarativeMeta, relationship as model_relationship
 
+logger = logging.getLogger(__name__)
+
+# (table, column) pairs already reported as having no data provider.
+_UNSUPPORTED_COLUMNS: Set[Tuple[str, str]] = set()
+
+
+def _override_declaration(override):
+    """Return a factory declaration for an override value.
+
+    JSON-like overrides are decoded from a serialized copy on every call, so
+    generated instances never share one mutable dict or list.
+    """
+    if not isinstance(override, (dict, list)):
+        return override
+    payload = json.dumps(override).encode()
+    return factory.LazyFunction(lambda: json.loads(payload))
+
 
 def _generate_many_to_one(model_factory, relation_name):
     def many_to_one(self, create, extracted, **kwargs):
@@ -29,17 +49,29 @@ def _generate_many_to_one(model_factory, relation_name):
     return factory.post_generation(many_to_one)
 
 
-def factory_generator(
-    models_module: types.ModuleType, overrides: Dict[str, Any] = None
-):
-    overrides = overrides or {}
-    class_members = inspect.getmembers(models_module, inspect.isclass)
-    tables_to_models = {
-        member.__tablename__: member
-        for _, member in class_members
-        if isinstance(member, DeclarativeMeta) and hasattr(member, "__tablename__")
-    }
-    data_providers = {
+# Weak memos, so cached lookups don't keep columns, tables and metadata alive.
+_FK_TARGET_FULLNAMES = weakref.WeakKeyDictionary()
+_RELATION_LOCAL_KEYS = weakref.WeakKeyDictionary()
+
+
+def _fk_target_fullname(col) -> str:
+    fullname = _FK_TARGET_FULLNAMES.get(col)
+    if fullname is None:
+        fullname = next(iter(col.foreign_keys)).column.table.fullname
+        _FK_TARGET_FULLNAMES[col] = fullname
+    return fullname
+
+
+def _relation_local_key(relation) -> str:
+    key = _RELATION_LOCAL_KEYS.get(relation)
+    if key is None:
+        key = next(iter(relation.local_columns)).key
+        _RELATION_LOCAL_KEYS[relation] = key
+    return key
+
+
+_DATA_PROVIDERS = types.MappingProxyType(
+    {
         UUID: lambda _: factory.Faker("uuid4"),
         String: lambda col: factory.Faker("pystr", max_chars=col.type.length or 36)
         if not col.primary_key
@@ -57,6 +89,33 @@ def factory_generator(
         JSON: lambda _: {},
         postgresql.JSONB: lambda _: {},
     }
+)
+
+
+_TABLES_TO_MODELS_CACHE: Dict[int, Dict[str, DeclarativeMeta]] = {}
+
+
+def _get_tables_to_models(
+    models_module: types.ModuleType,
+) -> Dict[str, DeclarativeMeta]:
+    key = id(models_module)
+    tables_to_models = _TABLES_TO_MODELS_CACHE.get(key)
+    if tables_to_models is None:
+        class_members = inspect.getmembers(models_module, inspect.isclass)
+        tables_to_models = {
+            member.__tablename__: member
+            for _, member in class_members
+            if isinstance(member, DeclarativeMeta) and hasattr(member, "__tablename__")
+        }
+        _TABLES_TO_MODELS_CACHE[key] = tables_to_models
+    return tables_to_models
+
+
+def factory_generator(
+    models_module: types.ModuleType, overrides: Dict[str, Any] = None
+):
+    overrides = overrides or {}
+    tables_to_models = _get_tables_to_models(models_module)
 
     model_instance_registry: Dict[str, BaseModel] = {}
     factory_registry: Dict[str, Factory] = {}
@@ -80,40 +139,62 @@ def factory_generator(
         if table_name in factory_registry:
             return factory_registry[table_name]
 
-        factory_attributes = {}
-        processed_tables = set(processed_tables or set())
+        # Tables on the current recursion path; shared across recursive calls.
+        # Only the frame that added a table removes it again, so re-entering an
+        # ancestor (e.g. via a dynamic FK relationship) keeps its marker.
+        processed_tables = processed_tables if processed_tables is not None else set()
+        added = table_name not in processed_tables
         processed_tables.add(table_name)
+        try:
+            return build_factory(model, table_name, processed_tables)
+        finally:
+            if added:
+                processed_tables.discard(table_name)
+
+    def build_factory(
+        model: DeclarativeMeta, table_name: str, processed_tables: Set[str]
+    ):
+        factory_attributes = {}
 
         factory_meta = type("Meta", (), {"model": model})
 
-        relation_cols = {
-            next(iter(relation.local_columns)).key
-            for relation in model.__mapper__.relationships
-        }
+        relationships = tuple(model.__mapper__.relationships)
+        relation_cols = frozenset(
+            _relation_local_key(relation) for relation in relationships
+        )
+        table_overrides = overrides.get(table_name) or {}
 
         dynamic_relationships = []
 
-        for col in model.__table__.c._all_columns:
+        for col in model.__table__.columns:
             if col.foreign_keys:
-                if col.key in relation_cols or col.key[-3:] != "_id":
+                if col.key in relation_cols or not col.key.endswith("_id"):
                     continue
                 dynamic_relationships.append(
                     {
-                        "foreign_table_name": next(
-                            iter(col.foreign_keys)
-                        ).column.table.fullname,
+                        "foreign_table_name": _fk_target_fullname(col),
                         "relation_name": col.key[:-3],
                     }
                 )
 
-            override = (overrides.get(table_name) or {}).get(col.name)  # type: ignore
+            override = table_overrides.get(col.name)
             if override:
-                factory_attributes[col.name] = override
+                factory_attributes[col.name] = _override_declaration(override)
+                continue
+
+            data_provider = _DATA_PROVIDERS.get(type(col.type))
+            if data_provider is None:
+                if (table_name, col.name) not in _UNSUPPORTED_COLUMNS:
+                    _UNSUPPORTED_COLUMNS.add((table_name, col.name))
+                    logger.warning(
+                        f"No data provider for {table_name}.{col.name} "
+                        f"of type {type(col.type).__name__}. Skipping"
+                    )
                 continue
 
-            factory_attributes[col.name] = data_providers[type(col.type)](col)
+            factory_attributes[col.name] = data_provider(col)
 
-        for relationship in list(model.__mapper__.relationships):
+        for relationship in relationships:
             foreign_table_name = relationship.target.fullname
 
             if foreign_table_name in processed_tables:
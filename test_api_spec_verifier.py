@@ -1,14 +1,21 @@
+import copy
+import hashlib
 import json
 import logging
+import os
+import pickle
 import re
+import tempfile
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from http import HTTPStatus
 from os import getenv
-from typing import Dict, Set, Any
+from typing import Dict, Set, Any, Callable, List, Optional, Tuple
 from unittest.mock import patch, MagicMock
 
 import jsonref
+import pytest
 import yaml
 from cds_common.cds_rds_v1 import tables as db_tables
 from cds_common.cds_rds_v1.tables import (
@@ -18,22 +25,101 @@ from cds_common.cds_rds_v1.tables import (
     Job,
     ResourceStatusEvent,
 )
-from jsonschema.exceptions import ValidationError
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker
-from jsonschema import validate as validate_by_schema
+from jsonschema import Draft202012Validator
+from jsonschema.exceptions import ValidationError, best_match
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.orm import scoped_session, sessionmaker
 
 from tests.api_spec_verification.model_factory_generator import factory_generator
 
+try:
+    from orjson import loads as _loads_response_body
+except ImportError:
+    from json import loads as _loads_response_body
+
 logger = logging.getLogger(__name__)
 
+_PATH_PARAM_RE = re.compile(r"\{([^}]+)\}")
+
+# Endpoints are verified concurrently by this many threads. The handler has to be
+# thread-safe for values above 1; keep it within the DBInitializer pool size.
+_VERIFIER_WORKERS = int(getenv("API_VERIFIER_WORKERS", "1"))
+
 
 class ApiVerifierException(Exception):
     pass
 
 
+# Bump when a loader changes what it returns, so stale pickles are not served.
+_CACHE_FORMAT_VERSION = 2
+
+
+def _get_cache_dir() -> Optional[str]:
+    """Return a private per-user cache dir, or None if it can't be trusted."""
+    cache_root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    cache_dir = os.path.join(cache_root, "api_spec_verifier")
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+        stat = os.stat(cache_dir)
+    except OSError:
+        return None
+    # Unpickling runs arbitrary code, so only use a dir no one else can write to.
+    if stat.st_uid != os.getuid() or stat.st_mode & 0o077:
+        return None
+    return cache_dir
+
+
+def _cached_load(path: str, loader: Callable[[str], Any]) -> Any:
+    """Load `path` with `loader`, caching the result as a pickle per user.
+
+    The cache is keyed by the cache format version, the loader and the file's
+    path, mtime and size, so editing the file invalidates it.
+    """
+    cache_dir = _get_cache_dir()
+    if cache_dir is None:
+        return loader(path)
+
+    stat = os.stat(path)
+    key_source = (
+        f"{_CACHE_FORMAT_VERSION}:{loader.__name__}:{os.path.abspath(path)}"
+        f":{stat.st_mtime}:{stat.st_size}"
+    )
+    key = hashlib.md5(key_source.encode()).hexdigest()
+    cache_path = os.path.join(cache_dir, f"{key}.pkl")
+
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except Exception:
+        # A stale or corrupt pickle can fail in many ways; reload the source.
+        logger.debug(f"Ignoring unreadable cache file {cache_path}", exc_info=True)
+
+    obj = loader(path)
+    tmp_cache_path = None
+    try:
+        fd, tmp_cache_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_cache_path, cache_path)
+    except Exception:
+        # The data itself loaded fine; failing to cache it must not fail the run.
+        logger.debug(f"Could not write cache file {cache_path}", exc_info=True)
+        if tmp_cache_path and os.path.exists(tmp_cache_path):
+            os.unlink(tmp_cache_path)
+    return obj
+
+
+def _read_json(path: str) -> Any:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
 class DBInitializer:
+    engine = None
     session = None
+    scoped_session = None
 
     primary_keys: Dict[str, str] = {}
 
@@ -41,19 +127,25 @@ class DBInitializer:
     def start(cls):
         cls.engine = create_engine(
             f"postgresql+psycopg2://{getenv('POSTGRES_USER')}:{getenv('POSTGRES_PASSWORD')}"
-            f"@127.0.0.1:{getenv('POSTGRES_PORT')}/{getenv('POSTGRES_DB')}"
+            f"@127.0.0.1:{getenv('POSTGRES_PORT')}/{getenv('POSTGRES_DB')}",
+            pool_size=10,
+            max_overflow=20,
+            pool_pre_ping=True,
+            pool_recycle=1800,
+            connect_args={"options": "-c jit=off"},
         )
         Base.metadata.create_all(cls.engine)
-        cls.session = sessionmaker(bind=cls.engine)()
+        session_factory = sessionmaker(bind=cls.engine)
+        cls.session = session_factory()
+        cls.scoped_session = scoped_session(session_factory)
         cls._init_data()
-        cls.primary_keys = cls._load_primary_keys()
 
     @classmethod
     def _get_overrides(cls):
-        with open(
-            "./tests/api_spec_verification/json_fields_fixtures/json_fixtures.json", "r"
-        ) as f:
-            json_overrides = json.load(f)
+        json_overrides = _cached_load(
+            "./tests/api_spec_verification/json_fields_fixtures/json_fixtures.json",
+            _read_json,
+        )
         overrides = defaultdict(dict, json_overrides)
 
         overrides["pipeline_configs"] = {
@@ -76,57 +168,101 @@ class DBInitializer:
         cls.job_factory = cls.factory_generator(Job)
         cls.status_event_factory = cls.factory_generator(ResourceStatusEvent)
 
-        cls.session.add(cls.pipeline_factory())
-        cls.session.add(cls.stage_manual_dec_factory())
-        cls.session.add(cls.job_factory())
-        cls.session.add(cls.status_event_factory())
+        cls.session.add_all(
+            [
+                cls.pipeline_factory(),
+                cls.stage_manual_dec_factory(),
+                cls.job_factory(),
+                cls.status_event_factory(),
+            ]
+        )
 
         cls.session.commit()
 
     @classmethod
-    def _load_primary_keys(cls):
-        table_primary_keys = {}
-        for table_name, primary_key in cls.session.execute(
-            """
+    def load_primary_keys(cls, needed_tables: Set[str]):
+        cls.primary_keys = cls._load_primary_keys(needed_tables)
+
+    @classmethod
+    def _load_primary_keys(cls, needed_tables: Set[str]):
+        if not needed_tables:
+            return {}
+
+        primary_key_columns = list(
+            cls.session.execute(
+                text(
+                    """
             SELECT tc.table_name, kcu.column_name
             FROM information_schema.table_constraints tc
             JOIN information_schema.key_column_usage kcu
                 ON tc.constraint_name = kcu.constraint_name
             WHERE tc.constraint_type = 'PRIMARY KEY' AND tc.table_schema = 'public'
+                AND tc.table_name IN :table_names
         """
+                ).bindparams(bindparam("table_names", expanding=True)),
+                {"table_names": sorted(needed_tables)},
+            )
+        )
+        if not primary_key_columns:
+            return {}
+
+        # Probe every table in a single round trip. Identifiers cannot be bound,
+        # so they are quoted by the dialect; table names go in as parameters.
+        quote = cls.engine.dialect.identifier_preparer.quote
+        probes = []
+        params = {}
+        for index, (table_name, primary_key) in enumerate(primary_key_columns):
+            probes.append(
+                f"(SELECT :table_{index} AS table_name, "
+                f"{quote(primary_key)}::text AS primary_key_value "
+                f"FROM {quote(table_name)} LIMIT 1)"
+            )
+            params[f"table_{index}"] = table_name
+
+        table_primary_keys = {}
+        for table_name, primary_key_value in cls.session.execute(
+            text(" UNION ALL ".join(probes)), params
         ):
-            primary_key_value = cls.session.execute(
-                text(
-                    f"""
-                SELECT {primary_key}
-                FROM {table_name}
-                LIMIT 1
-            """
-                )
-            ).scalar()
             if primary_key_value is not None:
                 table_primary_keys[table_name] = primary_key_value
         return table_primary_keys
 
     @classmethod
     def stop(cls):
-        if not cls.session:
-            return
-        cls.session.close()
+        try:
+            if cls.scoped_session:
+                cls.scoped_session.remove()
+            if cls.session:
+                cls.session.close()
+        finally:
+            if cls.engine:
+                cls.engine.dispose()
 
 
-def _load_spec():
-    with open("./src/cds_api/docs/openapi.yml", "r") as f:
+def _read_spec(path: str):
+    with open(path, "r") as f:
         spec = yaml.full_load(f)
-    return jsonref.loads(json.dumps(spec))
+    # Resolve every $ref up front into plain dicts, so reads in the endpoint loop
+    # don't go through lazy jsonref proxies. Referenced subtrees stay shared (and
+    # recursive schemas cyclic); per-endpoint schemas are deep-copied before use.
+    return jsonref.replace_refs(spec, lazy_load=False, proxies=False)
+
+
+def _load_spec():
+    return _cached_load("./src/cds_api/docs/openapi.yml", _read_spec)
 
 
 def _event_factory():
-    with open("./tests/api_spec_verification/lambda_event_fixture.json", "r") as f:
-        event_template = json.load(f)
+    event_template = _cached_load(
+        "./tests/api_spec_verification/lambda_event_fixture.json", _read_json
+    )
+
+    # Rebuilt per call: a shallow copy would share nested dicts such as
+    # requestContext between events.
+    template_bytes = json.dumps(event_template).encode()
 
     def _get_event(endpoint):
-        event = event_template.copy()
+        event = json.loads(template_bytes)
         event["path"] = endpoint
         event["pathParameters"] = {"proxy": endpoint}
         event["requestContext"]["path"] = endpoint
@@ -136,21 +272,46 @@ def _event_factory():
 
 
 def _update_nullable(schema: Dict) -> Dict:
-    if isinstance(schema, dict):
-        if schema.get("nullable") is True:
-            schema["type"] = [schema["type"], "null"]
-            del schema["nullable"]
-
-        for key, value in schema.items():
-            schema[key] = _update_nullable(value)
-    elif isinstance(schema, list):
-        for index, item in enumerate(schema):
-            schema[index] = _update_nullable(item)
+    stack = [schema]
+    visited: Set[int] = set()
+    while stack:
+        node = stack.pop()
+        if id(node) in visited:
+            continue
+        if isinstance(node, dict):
+            visited.add(id(node))
+            if node.get("nullable") is True:
+                node["type"] = [node["type"], "null"]
+                del node["nullable"]
+            stack.extend(node.values())
+        elif isinstance(node, list):
+            visited.add(id(node))
+            stack.extend(node)
     return schema
 
 
 def _update_nullable_to_json_schema_compatible(schema):
-    return _update_nullable(schema.copy())
+    return _update_nullable(copy.deepcopy(schema))
+
+
+def _collect_eligible_endpoints(spec) -> List[Tuple[str, Dict]]:
+    return [
+        (endpoint, endpoint_data)
+        for endpoint, endpoint_data in spec["paths"].items()
+        if "/app-registry/" not in endpoint
+        and "/cds/" in endpoint
+        and "get" in endpoint_data
+        and "200" in endpoint_data["get"]["responses"]
+    ]
+
+
+def _build_validator(endpoint_data: Dict) -> Draft202012Validator:
+    schema = endpoint_data["get"]["responses"]["200"]["content"][
+        "application/vnd.api+json"
+    ]["schema"]
+    schema = _update_nullable_to_json_schema_compatible(schema)
+    Draft202012Validator.check_schema(schema)
+    return Draft202012Validator(schema, format_checker=None)
 
 
 class FakeSSMClient:
@@ -205,8 +366,14 @@ def test_verify_api(
     api_connector,
     app_registry,
 ):
+    if _VERIFIER_WORKERS < 1:
+        raise ApiVerifierException(
+            f"API_VERIFIER_WORKERS must be at least 1, got {_VERIFIER_WORKERS}"
+        )
+
     DBInitializer.start()
     spec = _load_spec()
+    eligible_endpoints = _collect_eligible_endpoints(spec)
 
     global_settings.get_settings.return_value = MagicMock()
     get_global_settings.return_value = global_settings
@@ -214,7 +381,10 @@ def test_verify_api(
     get_ldap.return_value = None
     check_auth.return_value = None
 
-    api_connector.get_cds_api_session.return_value = DBInitializer.session
+    # Every worker thread gets its own session from the scoped registry.
+    api_connector.get_cds_api_session.side_effect = (
+        lambda *args, **kwargs: DBInitializer.scoped_session()
+    )
     cmp_connector.get_cmp_engine_session.return_value = (None, None)
 
     boto3_client.return_value = FakeSSMClient()
@@ -231,66 +401,80 @@ def test_verify_api(
     successful_checks: Set[str] = set()
 
     views_by_spec_path = get_view_by_full_path()
+    # Only endpoints with path parameters need a table; other views may have
+    # no backend model at all.
+    endpoint_to_table = {}
+    for endpoint, _ in eligible_endpoints:
+        view = views_by_spec_path.get(endpoint)
+        if view and _PATH_PARAM_RE.search(endpoint):
+            endpoint_to_table[endpoint] = view.backend.model.__tablename__
+    DBInitializer.load_primary_keys(set(endpoint_to_table.values()))
 
     event_factory = _event_factory()
-    for endpoint, endpoint_data in spec["paths"].items():
-        if (
-            "/app-registry/" in endpoint
-            or "/cds/" not in endpoint
-            or "get" not in endpoint_data
-            or "200" not in endpoint_data["get"]["responses"]
-        ):
-            continue
 
+    def verify_endpoint(endpoint, endpoint_data):
         full_api_endpoint = f"api/v2{endpoint}"
 
-        pattern = r"\{([^}]+)\}"
-        primary_keys_in_link = re.findall(pattern, endpoint)
+        primary_keys_in_link = _PATH_PARAM_RE.findall(endpoint)
 
         if primary_keys_in_link:
-            view = views_by_spec_path.get(endpoint)
-            if not view:
+            endpoint_table_name = endpoint_to_table.get(endpoint)
+            if not endpoint_table_name:
                 logger.warning(
                     f"View could not be found or {full_api_endpoint}. Skipping"
                 )
-                continue
-            endpoint_table_name = view.backend.model.__tablename__
+                return
             created_pk = DBInitializer.primary_keys.get(endpoint_table_name)
             if not created_pk:
                 logger.warning(
                     f"Primary key not found for {full_api_endpoint}. Skipping"
                 )
-                continue
+                return
             full_api_endpoint = full_api_endpoint.replace(
                 f"{{{primary_keys_in_link[0]}}}", str(created_pk)
             )
 
-        schema = endpoint_data["get"]["responses"]["200"]["content"][
-            "application/vnd.api+json"
-        ]["schema"]
+        # Built only for endpoints that are actually requested, so schemas of
+        # skipped endpoints are never read.
+        validator = _build_validator(endpoint_data)
 
-        schema = _update_nullable_to_json_schema_compatible(schema)
-
-        response = handler_main(
-            event_factory(full_api_endpoint),
-            LambdaContext,
-        )
+        try:
+            response = handler_main(
+                event_factory(full_api_endpoint),
+                LambdaContext,
+            )
+        finally:
+            DBInitializer.scoped_session.remove()
 
         if response["statusCode"] != HTTPStatus.OK:
             http_errors[full_api_endpoint] = response["statusCode"]
-            continue
+            return
 
-        result = json.loads(response.get("body"))
+        result = _loads_response_body(response.get("body"))
 
         if not result["data"]:
             empty_responses.add(endpoint)
-            continue
+            return
+
+        # Report the most relevant error, as jsonschema.validate() does.
+        error = best_match(validator.iter_errors(result))
+        if error is not None:
+            schema_errors[endpoint] = error.message
+            return
+        successful_checks.add(endpoint)
 
+    with ThreadPoolExecutor(max_workers=_VERIFIER_WORKERS) as executor:
+        futures = [
+            executor.submit(verify_endpoint, endpoint, endpoint_data)
+            for endpoint, endpoint_data in eligible_endpoints
+        ]
         try:
-            validate_by_schema(instance=result, schema=schema)
-            successful_checks.add(endpoint)
-        except ValidationError as e:
-            schema_errors[endpoint] = e.message
+            for future in as_completed(futures):
+                future.result()
+        except BaseException:
+            # Fail fast instead of waiting for every queued endpoint to run.
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     errors = any([http_errors, schema_errors, empty_responses])
 
@@ -301,3 +485,87 @@ def test_verify_api(
         )
     checks_result = "\nGET: ".join(successful_checks)
     print(f"Successfully checked: \n\nGET: {checks_result}")
+
+
+def _get_endpoint_data(schema):
+    return {
+        "get": {
+            "responses": {
+                "200": {"content": {"application/vnd.api+json": {"schema": schema}}}
+            }
+        }
+    }
+
+
+def test_collect_eligible_endpoints_only_verifiable():
+    nullable_schema = {
+        "type": "object",
+        "properties": {"data": {"type": "string", "nullable": True}},
+    }
+    spec = {
+        "paths": {
+            "/cds/pipelines": _get_endpoint_data(nullable_schema),
+            "/cds/app-registry/apps": _get_endpoint_data(nullable_schema),
+            "/other/pipelines": _get_endpoint_data(nullable_schema),
+            "/cds/jobs": {"post": {"responses": {"200": {}}}},
+            "/cds/stages": {"get": {"responses": {"404": {}}}},
+        }
+    }
+
+    eligible_endpoints = _collect_eligible_endpoints(spec)
+
+    assert [endpoint for endpoint, _ in eligible_endpoints] == ["/cds/pipelines"]
+    validator = _build_validator(eligible_endpoints[0][1])
+    validator.validate({"data": None})
+    with pytest.raises(ValidationError):
+        validator.validate({"data": 1})
+    assert nullable_schema["properties"]["data"] == {
+        "type": "string",
+        "nullable": True,
+    }
+
+
+def test_build_validator_keeps_shared_refs_intact():
+    name_ref = {"$ref": "#/components/schemas/Name"}
+    spec = jsonref.replace_refs(
+        {
+            "components": {"schemas": {"Name": {"type": "string", "nullable": True}}},
+            "paths": {
+                "/cds/pipelines": _get_endpoint_data(
+                    {
+                        "type": "object",
+                        "properties": {"name": name_ref, "owner": name_ref},
+                    }
+                ),
+                "/cds/jobs": _get_endpoint_data(name_ref),
+            },
+        },
+        lazy_load=False,
+        proxies=False,
+    )
+    shared_schema = spec["components"]["schemas"]["Name"]
+    paths = spec["paths"]
+    pipelines_schema = paths["/cds/pipelines"]["get"]["responses"]["200"]["content"][
+        "application/vnd.api+json"
+    ]["schema"]
+    assert pipelines_schema["properties"]["name"] is shared_schema
+
+    pipelines_validator = _build_validator(paths["/cds/pipelines"])
+    jobs_validator = _build_validator(paths["/cds/jobs"])
+
+    pipelines_validator.validate({"name": None, "owner": None})
+    jobs_validator.validate(None)
+    with pytest.raises(ValidationError):
+        pipelines_validator.validate({"name": "pipeline", "owner": 1})
+    assert shared_schema == {"type": "string", "nullable": True}
+
+
+def test_update_nullable_handles_recursive_schemas():
+    node = {"type": "object", "nullable": True, "properties": {}}
+    node["properties"]["child"] = node
+    node["properties"]["children"] = {"type": "array", "items": node}
+
+    _update_nullable(node)
+
+    assert node["type"] == ["object", "null"]
+    assert "nullable" not in node